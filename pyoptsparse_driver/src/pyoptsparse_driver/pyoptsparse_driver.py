@@ -5,10 +5,18 @@ pyoptsparse is an object-oriented framework for formulating and solving nonlinea
 constrained optimization problems.
 """
 
+from __future__ import print_function
+
 # pylint: disable=E0611,F0401
-from numpy import array, zeros, ones, float32, float64, int32, int64
+import multiprocessing
+import os
+
+from numpy import array, ones, float32, float64, int32, int64
 import numpy as np
+import networkx as nx
+from scipy.sparse import csr_matrix
 
+import pyoptsparse
 from pyoptsparse import Optimization
 
 from openmdao.main.api import Driver
@@ -21,6 +29,11 @@ from openmdao.main.hasconstraints import HasConstraints, Has2SidedConstraints
 from openmdao.main.hasobjective import HasObjectives
 from openmdao.util.decorators import add_delegate
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 
 def _check_imports():
     """ Dynamically remove optimizers we don't have
@@ -30,13 +43,92 @@ def _check_imports():
                'NLPQL', 'NLPY_AUGLAG', 'NSGA2', 'PSQP', 'SLSQP',
                'SNOPT']
 
-    for optimizer in optlist[:]:
-        try:
-            exec('from pyoptsparse import %s' % optimizer)
-        except ImportError:
-            optlist.remove(optimizer)
+    return [optimizer for optimizer in optlist
+            if hasattr(pyoptsparse, optimizer)]
+
+# Optimizers available in this installation, found once at import
+_OPTIMIZERS = _check_imports()
+
+
+def _round_ints(vals, types, out):
+    """ Copy the flat design variable array vals into out, rounding the
+    entries flagged as integer (types == 1) to the nearest whole number.
+    """
+
+    for i in range(vals.size):
+        if types[i] == 1:
+            out[i] = np.rint(vals[i])
+        else:
+            out[i] = vals[i]
+
+if njit is not None:
+    # An explicit signature compiles eagerly at import, and cache=True
+    # loads that compiled code from disk on later imports.
+    _round_ints = njit('void(f8[:], i1[:], f8[:])', cache=True)(_round_ints)
+else:
+    def _round_ints(vals, types, out):
+        """ Vectorized fallback for when numba is not installed.
+        """
+        np.copyto(out, np.where(types == 1, np.rint(vals), vals))
+
+
+def _shared_zeros(size, cache):
+    """ Return a read-only float64 array of zeros of the given size. Arrays
+    are shared through cache between callers asking for the same size.
+    """
+
+    zero = cache.get(size)
+    if zero is None:
+        zero = np.zeros(size, dtype=np.float64)
+        zero.flags.writeable = False
+        cache[size] = zero
+
+    return zero
+
+
+# Driver used by the finite difference worker processes
+_fd_driver = None
+
+
+def _init_fd_worker(driver):
+    """ Pool initializer. The driver is inherited through fork rather than
+    pickled, so each worker gets its own copy of the model.
+    """
 
-    return optlist
+    global _fd_driver
+    _fd_driver = driver
+
+
+def _fd_column(args):
+    """ Forward difference the functions in of with respect to the
+    parameters in wrt, about the point dv_dict where the functions take
+    the values in func_dict. Runs in a worker process.
+    """
+
+    dv_dict, func_dict, of, wrt, step = args
+    dv_dict = dict((name, np.array(val, dtype=np.float64, ndmin=1))
+                   for name, val in dv_dict.items())
+
+    sens_dict = dict((name, {}) for name in of)
+    for wrt_name in wrt:
+        x = dv_dict[wrt_name]
+        jacs = dict((name, np.empty((func_dict[name].size, x.size)))
+                    for name in of)
+        for j in range(x.size):
+            x0 = x[j]
+            x[j] = x0 + step
+            funcs, fail = _fd_driver.objfunc(dv_dict)
+            x[j] = x0
+            if fail:
+                raise RuntimeError('Function evaluation failed while '
+                                   'differencing %s' % wrt_name)
+            for name in of:
+                jacs[name][:, j] = (funcs[name] - func_dict[name]) / step
+
+        for name in of:
+            sens_dict[name][wrt_name] = jacs[name]
+
+    return sens_dict
 
 
 @add_delegate(HasParameters, HasConstraints, HasObjectives,
@@ -48,7 +140,7 @@ class pyOptSparseDriver(Driver):
     implements(IHasParameters, IHasConstraints, IHasObjective, IOptimizer,
                IHas2SidedConstraints)
 
-    optimizer = Enum('ALPSO', _check_imports(), iotype='in',
+    optimizer = Enum('ALPSO', _OPTIMIZERS, iotype='in',
                      desc='Name of optimizers to use')
     title = Str('Optimization using pyOpt', iotype='in',
                 desc='Title of this optimization run')
@@ -58,6 +150,26 @@ class pyOptSparseDriver(Driver):
                          desc='Print pyOpt results if True')
     pyopt_diff = Bool(False, iotype='in',
                       desc='Set to True to let pyOpt calculate the gradient')
+    parallel_fd = Bool(False, iotype='in',
+                       desc='Set to True to spread pyOpt\'s finite difference '
+                            'steps across MPI processes (requires pyopt_diff '
+                            'and launching under mpirun)')
+    n_workers = Int(1, iotype='in',
+                    desc='Number of forked worker processes used to finite '
+                         'difference the gradient when pyopt_diff is False. '
+                         'Values above 1 replace calc_gradient with a '
+                         'forward difference of absolute step '
+                         'gradient_options.fd_step; fd_form and '
+                         'fd_step_type are ignored. Requires the fork start '
+                         'method, and cannot be used with case recorders '
+                         'since each worker runs the full driver iteration')
+    skip_redundant_final_run = Bool(True, iotype='in',
+                                    desc='Skip the final model run when the '
+                                         'optimum is the last point evaluated. '
+                                         'calc_gradient and pyOpt\'s finite '
+                                         'difference may move the model, so '
+                                         'in practice this only applies with '
+                                         'n_workers > 1')
 
     exit_flag = Int(0, iotype="out", desc="0 for fail, 1 for ok")
 
@@ -83,26 +195,63 @@ class pyOptSparseDriver(Driver):
         self.nlcons = None
         self.lin_jacs = {}
 
+        # Lookups cached by execute() for use in the optimizer callbacks.
+        self._param_cache = []
+        self._int_codes = None
+        self._int_index = None
+        self._obj_cache = []
+        self._con_cache = []
+        self._func_bufs = {}
+        self._grad_of = []
+        self._grad_wrt = []
+
+        # Rounded design variables the model was last run at, or None when
+        # its state is unknown
+        self._model_dvs = None
+
+        # Rounded design variables and results of the last successful
+        # objfunc and gradfunc calls
+        self._last_dvs = None
+        self._last_funcs = None
+        self._last_sens_dvs = None
+        self._last_sens = None
+
+        # Worker pool for parallel finite difference gradients
+        self._pool = None
+
+        # objfunc and gradfunc closures specialized by execute()
+        self._objfunc = None
+        self._gradfunc = None
+
     def execute(self):
         """pyOpt execution. Note that pyOpt controls the execution, and the
         individual optimizers control the iteration."""
 
         self.pyOpt_solution = None
+        self._model_dvs = None
+        self._last_dvs = None
+        self._last_funcs = None
+        self._last_sens_dvs = None
+        self._last_sens = None
 
         self.run_iteration()
 
-        opt_prob = Optimization(self.title, self.objfunc)
+        # The objfunc closure is only built once the caches below are set
+        # up, so pyOpt is given a forwarder to it.
+        opt_prob = Optimization(self.title,
+                                lambda dv_dict: self._objfunc(dv_dict))
 
         # Add all parameters
         self.param_type = {}
         self.nparam = self.total_parameters()
         param_list = []
+        param_cache = []
 
         #need a counter for lb and ub arrays
         i_param = 0
 
 
-        for name, param in self.get_parameters().iteritems():
+        for name, param in self.get_parameters().items():
 
             # We need to identify Enums, Lists, Dicts
             metadata = param.get_metadata()[1]
@@ -136,19 +285,21 @@ class pyOptSparseDriver(Driver):
                 lower_bounds = self.lb[i_param:i_param+n_vals]
                 upper_bounds = self.ub[i_param:i_param+n_vals]
 
+            param_cache.append((name, vartype,
+                                slice(i_param, i_param+n_vals)))
             i_param += n_vals
             opt_prob.addVarGroup(name, n_vals, type=vartype,
                                  lower=lower_bounds, upper=upper_bounds,
                                  value=values, choices=choices)
             param_list.append(name)
         # Add all objectives
-        for name, obj in self.get_objectives().iteritems():
+        for name, obj in self.get_objectives().items():
             name = '%s.out0' % obj.pcomp_name
             opt_prob.addObj(name)
 
         # Calculate and save gradient for any linear constraints.
-        lcons = self.get_constraints(linear=True).values() + \
-                self.get_2sided_constraints(linear=True).values()
+        lcons = list(self.get_constraints(linear=True).values()) + \
+                list(self.get_2sided_constraints(linear=True).values())
         if len(lcons) > 0:
             lcon_names = ['%s.out0' % obj.pcomp_name for obj in lcons]
             self.lin_jacs = self.workflow.calc_gradient(param_list, lcon_names,
@@ -156,35 +307,56 @@ class pyOptSparseDriver(Driver):
             #print "Linear Gradient"
             #print self.lin_jacs
 
+            # Linear Jacobians are mostly structural zeros, so hand them to
+            # pyOpt in its sparse CSR format.
+            for jac in self.lin_jacs.values():
+                for param_name, dense in jac.items():
+                    csr = csr_matrix(np.atleast_2d(dense))
+                    jac[param_name] = {'csr': [csr.indptr, csr.indices,
+                                               csr.data],
+                                       'shape': list(csr.shape)}
+
+        # Nonlinear constraints are declared against only the parameters
+        # they depend on, so pyOpt can build a sparse Jacobian.
+        param_reach = self._param_descendants(param_list)
+
+        # Constraints of the same size share their zero bounds. pyOpt keeps
+        # references to them, so the arrays are read-only: an in-place write
+        # raises instead of changing other constraints' bounds.
+        zero_cache = {}
+
         # Add all equality constraints
         nlcons = []
-        for name, con in self.get_eq_constraints().iteritems():
+        for name, con in self.get_eq_constraints().items():
             size = con.size
-            lower = zeros((size))
-            upper = zeros((size))
+            lower = upper = _shared_zeros(size, zero_cache)
             name = '%s.out0' % con.pcomp_name
             if con.linear is True:
                 opt_prob.addConGroup(name, size, lower=lower, upper=upper,
                                      linear=True, wrt=param_list,
                                      jac=self.lin_jacs[name])
             else:
-                opt_prob.addConGroup(name, size, lower=lower, upper=upper)
+                opt_prob.addConGroup(name, size, lower=lower, upper=upper,
+                                     wrt=self._con_wrt(con, param_list,
+                                                       param_reach))
                 nlcons.append(name)
 
         # Add all inequality constraints
-        for name, con in self.get_ineq_constraints().iteritems():
+        for name, con in self.get_ineq_constraints().items():
             size = con.size
-            upper = zeros((size))
+            upper = _shared_zeros(size, zero_cache)
             name = '%s.out0' % con.pcomp_name
             if con.linear is True:
                 opt_prob.addConGroup(name, size, upper=upper, linear=True,
                 wrt=param_list, jac=self.lin_jacs[name])
             else:
-                opt_prob.addConGroup(name, size, upper=upper)
+                opt_prob.addConGroup(name, size, upper=upper,
+                                     wrt=self._con_wrt(con, param_list,
+                                                       param_reach))
                 nlcons.append(name)
 
         # Add all double_sided constraints
-        for name, con in self.get_2sided_constraints().iteritems():
+        for name, con in self.get_2sided_constraints().items():
             size = con.size
             upper = con.high * ones((size))
             lower = con.low * ones((size))
@@ -194,54 +366,113 @@ class pyOptSparseDriver(Driver):
                                      linear=True, wrt=param_list,
                                      jac=self.lin_jacs[name])
             else:
-                opt_prob.addConGroup(name, size, upper=upper, lower=lower)
+                opt_prob.addConGroup(name, size, upper=upper, lower=lower,
+                                     wrt=self._con_wrt(con, param_list,
+                                                       param_reach))
                 nlcons.append(name)
 
         self.objs = self.list_objective_targets()
         self.nlcons = nlcons
+        self._grad_of = list(self.objs) + list(nlcons)
+        self._grad_wrt = list(param_list)
+
+        # The parameter, objective, and constraint sets are fixed for the
+        # duration of the run, so cache them for objfunc.
+        self._cache_params(param_cache)
+        self._obj_cache = [('%s.out0' % obj.pcomp_name, obj)
+                           for obj in self.get_objectives().values()]
+        cons = list(self.get_constraints().values()) + \
+               list(self.get_2sided_constraints().values())
+        self._con_cache = [('%s.out0' % con.pcomp_name, con) for con in cons]
+
+        # Result buffers that objfunc fills in place on every call.
+        self._func_bufs = {}
+        for name, obj in self._obj_cache:
+            self._func_bufs[name] = np.empty(1, dtype=np.float64)
+        for name, con in self._con_cache:
+            self._func_bufs[name] = np.empty(con.size, dtype=np.float64)
 
         # Instantiate the requested optimizer
         optimizer = self.optimizer
         try:
-            exec('from pyoptsparse import %s' % optimizer)
-        except ImportError:
+            opt_cls = getattr(pyoptsparse, optimizer)
+        except AttributeError:
             msg = "Optimizer %s is not available in this installation." % \
                    optimizer
             self.raise_exception(msg, ImportError)
 
-        optname = vars()[optimizer]
-        opt = optname()
+        opt = opt_cls()
 
         # Set optimization options
-        for option, value in self.options.iteritems():
+        for option, value in self.options.items():
             opt.setOption(option, value)
 
+        # Specialize the callbacks now that the caches are set up. objfunc
+        # goes first so that the forked gradient workers inherit it.
+        self._objfunc = self._make_objfunc()
+        if self.n_workers > 1 and not self.pyopt_diff:
+            # Any start method other than fork would pickle the driver and
+            # its whole assembly into each worker, so ask for fork
+            # explicitly rather than relying on the platform default.
+            get_context = getattr(multiprocessing, 'get_context', None)
+            ctx = None
+            if get_context is None:
+                # Python 2 always forks where it can.
+                if hasattr(os, 'fork'):
+                    ctx = multiprocessing
+            else:
+                try:
+                    ctx = get_context('fork')
+                except ValueError:
+                    pass
+            if ctx is None:
+                msg = "n_workers > 1 requires the fork start method, which " \
+                      "is not available on this platform."
+                self.raise_exception(msg, RuntimeError)
+
+            # Each worker runs the full driver iteration on its copy of the
+            # model, so recorders would log every perturbed point from
+            # several processes through the same inherited file handles.
+            obj = self
+            while obj is not None:
+                if getattr(obj, 'recorders', None):
+                    msg = "n_workers > 1 cannot be used while case " \
+                          "recorders are attached."
+                    self.raise_exception(msg, RuntimeError)
+                obj = obj.parent
+
+            self._pool = ctx.Pool(self.n_workers, _init_fd_worker, (self,))
+        self._gradfunc = self._make_gradfunc()
+
         # Execute the optimization problem
-        if self.pyopt_diff:
-            # Use pyOpt's internal finite difference
-            sol = opt(opt_prob, sens='FD', sensStep=self.gradient_options.fd_step)
-        else:
-            # Use OpenMDAO's differentiator for the gradient
-            sol = opt(opt_prob, sens=self.gradfunc)
+        try:
+            if self.pyopt_diff:
+                # Use pyOpt's internal finite difference. With parallel_fd,
+                # the steps are divided among the MPI processes (parallel
+                # gradient calculation), so the driver must be launched under
+                # mpirun.
+                sens_mode = 'pgc' if self.parallel_fd else ''
+                sol = opt(opt_prob, sens='FD',
+                          sensStep=self.gradient_options.fd_step,
+                          sensMode=sens_mode)
+            else:
+                # Use OpenMDAO's differentiator for the gradient
+                sol = opt(opt_prob, sens=self._gradfunc)
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
 
         # Print results
         if self.print_results:
-            print sol
+            print(sol)
 
 
 
         # Pull optimal parameters back into framework and re-run, so that
-        # framework is left in the right final state
-        dv_dict = sol.getDVs()
-        param_types = self.param_type
-        for name, param in self.get_parameters().iteritems():
-            val = dv_dict[name]
-            if param_types[name] == 'i':
-                val = int(round(val))
-
-            self.set_parameter_by_name(name, val)
-
-        self.run_iteration()
+        # framework is left in the right final state.
+        self._restore_optimum(sol.getDVs())
 
         # Save the most recent solution.
         self.pyOpt_solution = sol
@@ -253,79 +484,136 @@ class pyOptSparseDriver(Driver):
         except KeyError: #nothing is here, so something bad happened!
             self.exit_flag = 0
 
-    def objfunc(self, dv_dict):
-        """ Function that evaluates and returns the objective function and
-        constraints. This function is passed to pyOpt's Optimization object
-        and is called from its optimizers.
-
-        dv_dict: dict
-            Dictionary of design variable values
+    def _restore_optimum(self, dv_dict):
+        """ Set the parameters to the optimum in dv_dict and run the model
+        there. The run is skipped when the model was last run at the optimum
+        already.
+        """
 
-        Returns
+        dv_vals = self._pack_dvs(dv_dict)
+        if not self.skip_redundant_final_run or self._model_dvs is None or \
+           not np.array_equal(dv_vals, self._model_dvs):
+            self._set_dvs(dv_vals)
+            self.run_iteration()
+            self._model_dvs = dv_vals
 
-        func_dict: dict
-            Dictionary of all functional variables evaluated at design point
+    def _param_descendants(self, param_list):
+        """ Return a dict mapping each parameter in param_list to the set of
+        nodes downstream of its targets in the parent's dependency graph, or
+        None if the graph is not available.
+        """
 
-        fail: int
-            0 for successful function evaluation
-            1 for unsuccessful function evaluation
+        try:
+            graph = self.parent._depgraph
+            params = self.get_parameters()
+            param_reach = {}
+            for name in param_list:
+                reach = set()
+                for target in params[name].targets:
+                    reach.add(target)
+                    reach.update(nx.descendants(graph, target))
+                param_reach[name] = reach
+        except (AttributeError, KeyError, nx.NetworkXError):
+            return None
+
+        return param_reach
+
+    def _con_wrt(self, con, param_list, param_reach):
+        """ Return the parameters that the constraint con depends on, either
+        through its pseudocomp output or through the variables its
+        expression references. Falls back to all of param_list when the
+        dependency information is missing or finds nothing.
         """
 
-        fail = 1
-        func_dict = {}
+        if param_reach is None:
+            return param_list
 
         try:
+            refs = con.get_referenced_varpaths()
+        except AttributeError:
+            return param_list
+
+        con_name = '%s.out0' % con.pcomp_name
+        wrt = [name for name in param_list
+               if con_name in param_reach[name]
+               or not param_reach[name].isdisjoint(refs)]
+        return wrt or param_list
+
+    def _cache_params(self, param_cache):
+        """ Store the (name, vartype, slice) entry of each parameter and
+        find where the integer entries sit in the flat design variable array.
+        """
 
-            # Integer parameters come back as floats, so we need to round them
-            # and turn them into python integers before setting.
-            param_types = self.param_type
-            for name, param in self.get_parameters().iteritems():
-                val = dv_dict[name]
-                if param_types[name] == 'i':
-                    val = int(round(val))
+        self._param_cache = param_cache
+        size = param_cache[-1][2].stop if param_cache else 0
+        int_codes = np.zeros(size, dtype=np.int8)
+        for name, vartype, sl in param_cache:
+            if vartype == 'i':
+                int_codes[sl] = 1
 
-                self.set_parameter_by_name(name, val)
+        if int_codes.any():
+            self._int_codes = int_codes
+            self._int_index = np.flatnonzero(int_codes).tolist()
+        else:
+            self._int_codes = self._int_index = None
 
-            # Execute the model
-            #print "Setting DV"
-            #print dv_dict
-            self.run_iteration()
+    def _pack_dvs(self, dv_dict):
+        """ Stack the design variables in dv_dict into a flat array in
+        parameter order, with the integer parameters rounded.
+        """
+
+        dv_vals = np.hstack([dv_dict[name]
+                             for name, _, _ in self._param_cache])
+        if self._int_codes is not None:
+            _round_ints(dv_vals, self._int_codes, dv_vals)
 
-            # Get the objective function evaluations
-            for key, obj in self.get_objectives().iteritems():
-                name = '%s.out0' % obj.pcomp_name
-                func_dict[name] = array(obj.evaluate())
+        return dv_vals
 
-            # Get the constraint evaluations
-            for key, con in self.get_constraints().iteritems():
-                name = '%s.out0' % con.pcomp_name
-                func_dict[name] = array(con.evaluate(self.parent))
+    def _set_dvs(self, dv_vals):
+        """ Set all of the parameters in one call from the flat design
+        variable array returned by _pack_dvs. Integer entries are set as
+        python integers.
+        """
 
-            # Get the double-sided constraint evaluations
-            for key, con in self.get_2sided_constraints().iteritems():
-                name = '%s.out0' % con.pcomp_name
-                func_dict[name] = array(con.evaluate(self.parent))
+        int_index = self._int_index
+        if int_index is not None:
+            # Already rounded, so the cast is exact.
+            dv_vals = dv_vals.tolist()
+            for i in int_index:
+                dv_vals[i] = int(dv_vals[i])
 
-            fail = 0
+        self.set_parameters(dv_vals)
 
-        except Exception as msg:
+    def objfunc(self, dv_dict):
+        """ Function that evaluates and returns the objective function and
+        constraints at a design point. execute() hands pyOpt the closure
+        built by _make_objfunc instead, so the optimizers do not call this
+        method and overriding it does not change what they see.
 
-            # Exceptions seem to be swallowed by the C code, so this
-            # should give the user more info than the dreaded "segfault"
-            print "Exception: %s" % str(msg)
-            print 70*"="
-            import traceback
-            traceback.print_exc()
-            print 70*"="
+        dv_dict: dict
+            Dictionary of design variable values
 
-        #print "Functions calculated"
-        #print func_dict
-        return func_dict, fail
+        Returns
+
+        func_dict: dict
+            Dictionary of all functional variables evaluated at design point
+
+        fail: int
+            0 for successful function evaluation
+            1 for unsuccessful function evaluation
+        """
+
+        if self._objfunc is None:
+            self.raise_exception("objfunc is not available until execute() "
+                                 "has set up the problem.", RuntimeError)
+
+        return self._objfunc(dv_dict)
 
     def gradfunc(self, dv_dict, func_dict):
         """ Function that evaluates and returns the gradient of the objective
-        function and constraints. This function is passed to pyOpt's
-        Optimization object and is called from its optimizers.
+        function and constraints at a design point. execute() hands pyOpt
+        the closure built by _make_gradfunc instead, so the optimizers do not
+        call this method and overriding it does not change what they see.
 
         dv_dict: dict
             Dictionary of design variable values
@@ -343,29 +631,164 @@ class pyOptSparseDriver(Driver):
             1 for unsuccessful function evaluation
         """
 
-        fail = 1
-        sens_dict = {}
+        if self._gradfunc is None:
+            self.raise_exception("gradfunc is not available until execute() "
+                                 "has set up the problem.", RuntimeError)
 
-        try:
-            sens_dict = self.workflow.calc_gradient(dv_dict.keys(), self.objs + self.nlcons,
-                                                    return_format='dict')
-            #for key, value in self.lin_jacs.iteritems():
-            #    sens_dict[key] = value
-
-            fail = 0
+        return self._gradfunc(dv_dict, func_dict)
 
-        except Exception as msg:
+    def _make_objfunc(self):
+        """ Build the objfunc for the current run, with everything it needs
+        on each call bound to locals of the closure.
+        """
 
-            # Exceptions seem to be swallowed by the C code, so this
-            # should give the user more info than the dreaded "segfault"
-            print "Exception: %s" % str(msg)
-            print 70*"="
-            import traceback
-            traceback.print_exc()
-            print 70*"="
+        pack_dvs = self._pack_dvs
+        set_dvs = self._set_dvs
+        run_iteration = self.run_iteration
+        func_bufs = self._func_bufs
+        obj_cache = [(name, obj, func_bufs[name])
+                     for name, obj in self._obj_cache]
+        con_cache = [(name, con, func_bufs[name])
+                     for name, con in self._con_cache]
+        parent = self.parent
+        copyto = np.copyto
+        array_equal = np.array_equal
+
+        # On the pyopt_diff path pyOpt's own Gradient object drives the
+        # finite difference and caches the base point, so the memo below
+        # would only add a compare to every step.
+        memoize = not self.pyopt_diff
+
+        def objfunc(dv_dict):
+            """ See pyOptSparseDriver.objfunc. """
+
+            fail = 1
+            func_dict = {}
+
+            try:
+
+                # Integer parameters come back as floats, so we need to round
+                # them and turn them into python integers before setting.
+                dv_vals = pack_dvs(dv_dict)
+
+                # Optimizers often ask for the same point twice in a row, so
+                # return the results cached for it.
+                last_dvs = self._last_dvs
+                if memoize and last_dvs is not None and \
+                   array_equal(dv_vals, last_dvs):
+                    return dict(self._last_funcs), 0
+
+                # The model state is unknown until this evaluation succeeds.
+                self._model_dvs = None
+                self._last_dvs = None
+
+                set_dvs(dv_vals)
+
+                # Execute the model
+                #print "Setting DV"
+                #print dv_dict
+                run_iteration()
+
+                # Get the objective function evaluations. The buffers are
+                # reused across calls; pyOpt copies the values it keeps.
+                for name, obj, buf in obj_cache:
+                    copyto(buf, obj.evaluate())
+                    func_dict[name] = buf
+
+                # Get the constraint and double-sided constraint evaluations
+                for name, con, buf in con_cache:
+                    copyto(buf, con.evaluate(parent))
+                    func_dict[name] = buf
+
+                self._model_dvs = dv_vals
+                self._last_dvs = dv_vals
+                self._last_funcs = dict(func_dict)
+                fail = 0
+
+            except Exception as msg:
+
+                # Exceptions seem to be swallowed by the C code, so this
+                # should give the user more info than the dreaded "segfault"
+                print("Exception: %s" % str(msg))
+                print(70*"=")
+                import traceback
+                traceback.print_exc()
+                print(70*"=")
+
+            #print "Functions calculated"
+            #print func_dict
+            return func_dict, fail
+
+        return objfunc
+
+    def _make_gradfunc(self):
+        """ Build the gradfunc for the current run, with everything it needs
+        on each call bound to locals of the closure.
+        """
 
-        #print "Derivatives calculated"
-        #print dv_dict
-        #print sens_dict
-        return sens_dict, fail
+        pack_dvs = self._pack_dvs
+        array_equal = np.array_equal
+        calc_gradient = self.workflow.calc_gradient
+        of = self._grad_of
+        wrt = self._grad_wrt
+        n_workers = self.n_workers
+        step = self.gradient_options.fd_step
+
+        def gradfunc(dv_dict, func_dict):
+            """ See pyOptSparseDriver.gradfunc. """
+
+            fail = 1
+            sens_dict = {}
+
+            try:
+                # A repeat request at the same point returns the gradient
+                # cached for it.
+                dv_vals = pack_dvs(dv_dict)
+                last_dvs = self._last_sens_dvs
+                if last_dvs is not None and array_equal(dv_vals, last_dvs):
+                    return dict(self._last_sens), 0
+
+                # The pool only lives for the duration of execute(), so it
+                # is looked up on each call rather than bound above.
+                pool = self._pool
+                if pool is not None:
+                    # Forward difference in the worker processes, splitting
+                    # the parameters evenly among them.
+                    funcs = dict((name, np.asarray(func_dict[name]).flatten())
+                                 for name in of)
+                    jobs = [(dv_dict, funcs, of, wrt[i::n_workers], step)
+                            for i in range(min(n_workers, len(wrt)))]
+
+                    sens_dict = dict((name, {}) for name in of)
+                    for sens in pool.map(_fd_column, jobs):
+                        for name, jacs in sens.items():
+                            sens_dict[name].update(jacs)
+                else:
+                    # calc_gradient may re-run the model at perturbed
+                    # points, so its final state is no longer known. The
+                    # worker pool above leaves this process's model alone.
+                    self._model_dvs = None
+                    sens_dict = calc_gradient(wrt, of, return_format='dict')
+                #for key, value in self.lin_jacs.items():
+                #    sens_dict[key] = value
+
+                self._last_sens_dvs = dv_vals
+                self._last_sens = dict(sens_dict)
+                fail = 0
+
+            except Exception as msg:
+
+                # Exceptions seem to be swallowed by the C code, so this
+                # should give the user more info than the dreaded "segfault"
+                print("Exception: %s" % str(msg))
+                print(70*"=")
+                import traceback
+                traceback.print_exc()
+                print(70*"=")
+
+            #print "Derivatives calculated"
+            #print dv_dict
+            #print sens_dict
+            return sens_dict, fail
 
+        return gradfunc
@@ -1,11 +1,15 @@
 import unittest
 
+import numpy as np
+
 # pylint: disable=E0611,F0401
 from nose import SkipTest
 
-from pyoptsparse_driver.pyoptsparse_driver import pyOptSparseDriver
+from pyoptsparse_driver.pyoptsparse_driver import pyOptSparseDriver, \
+                                                 _round_ints
 
 from openmdao.util.testutil import assert_rel_error
+from openmdao.lib.casehandlers.api import ListCaseRecorder
 from openmdao.main.api import Assembly, set_as_top, Component, Driver
 from openmdao.main.datatypes.api import Array, Float, Int
 from openmdao.main.interfaces import IHasParameters, implements
@@ -165,6 +169,60 @@ class OptimizationConstrainedDerivatives(Assembly):
         self.driver.print_results = False
 
 
+class CountingDriver(pyOptSparseDriver):
+    """pyOptSparseDriver that counts how often it runs the model."""
+
+    def __init__(self):
+        super(CountingDriver, self).__init__()
+        self.n_runs = 0
+
+    def run_iteration(self):
+        self.n_runs += 1
+        super(CountingDriver, self).run_iteration()
+
+
+class CountedOptimization(Assembly):
+    """Constrained optimization of the Paraboloid with SLSQP, counting the
+    model runs."""
+
+    def configure(self):
+        """ Creates a new Assembly containing a Paraboloid and an optimizer"""
+
+        # pylint: disable=E1101
+
+        self.add('paraboloid', ParaboloidDerivative())
+        self.add('driver', CountingDriver())
+        self.driver.workflow.add('paraboloid')
+        self.driver.add_objective('paraboloid.f_xy')
+        self.driver.add_parameter('paraboloid.x', low=-50., high=50.)
+        self.driver.add_parameter('paraboloid.y', low=-50., high=50.)
+        self.driver.add_constraint('paraboloid.x-paraboloid.y >= 15.0')
+        self.driver.print_results = False
+
+
+class TwoParaboloids(Assembly):
+    """Two independent Paraboloids, with one constraint on the first only,
+    one on both, and one reading a parameter directly."""
+
+    def configure(self):
+        """ Creates a new Assembly containing two Paraboloids and an
+        optimizer"""
+
+        # pylint: disable=E1101
+
+        self.add('p1', Paraboloid())
+        self.add('p2', Paraboloid())
+        self.add('driver', pyOptSparseDriver())
+        self.driver.workflow.add(['p1', 'p2'])
+        self.driver.add_objective('p1.f_xy + p2.f_xy')
+        self.driver.add_parameter('p1.x', low=-50., high=50.)
+        self.driver.add_parameter('p2.x', low=-50., high=50.)
+        self.driver.add_constraint('p1.f_xy <= 10.0')
+        self.driver.add_constraint('p1.f_xy + p2.f_xy <= 20.0')
+        self.driver.add_constraint('p2.x + p1.f_xy <= 20.0')
+        self.driver.print_results = False
+
+
 class MultiFunction(Component):
     #Finds the minimum f(1) = x[1]
     #              and f(2) = (1+x[2])/x[1]
@@ -252,6 +310,21 @@ class BenchMark(Component):
         self.h1_x = -x1 - 2.*x2 - 2.*x3
 
 
+class IntArrayComp(Component):
+    """Component with integer, integer array, and float array inputs."""
+
+    # pylint: disable=E1101
+    n = Int(0, iotype='in', desc='An integer')
+    ix = Array(np.zeros(2, dtype=int), dtype=int, iotype='in',
+               desc='An integer array')
+    x = Array([0., 0.], iotype='in', desc='A float array')
+
+    f_x = Float(iotype='out', desc='f(x)')
+
+    def execute(self):
+        self.f_x = self.n + sum(self.ix) + sum(self.x)
+
+
 class BenchMarkOptimization(Assembly):
     """Benchmark Problem Objective optimization with ALPSO."""
 
@@ -313,6 +386,16 @@ class pyOptSparseDriverTestCase(unittest.TestCase):
     def tearDown(self):
         self.top = None
 
+    def test_round_ints(self):
+
+        vals = np.array([1.4, 2.6, -0.7, 3.5])
+        types = np.array([1, 0, 1, 0], dtype=np.int8)
+        out = np.zeros(4)
+
+        _round_ints(vals, types, out)
+
+        self.assertEqual(list(out), [1.0, 2.6, -1.0, 3.5])
+
     def test_basic_SNOPT(self):
 
         try:
@@ -448,6 +531,271 @@ class pyOptSparseDriverTestCase(unittest.TestCase):
         assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
         assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
 
+    def _counted_optimization(self):
+
+        try:
+            from pyoptsparse import Optimization
+        except ImportError:
+            raise SkipTest("this test requires pyoptsparse to be installed")
+
+        top = set_as_top(CountedOptimization())
+
+        try:
+            top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        return top
+
+    def _set_dvs(self, driver, param_cache, dv_dict):
+        # Round and set the design variables the way objfunc does.
+        driver._cache_params(param_cache)
+        driver._set_dvs(driver._pack_dvs(dv_dict))
+
+    def test_set_int_params(self):
+
+        self.top = set_as_top(Assembly())
+        self.top.add('benchmark', BenchMark())
+        self.top.add('driver', pyOptSparseDriver())
+        self.top.driver.workflow.add('benchmark')
+        self.top.driver.add_parameter('benchmark.x1', low=0, high=42)
+        self.top.driver.add_parameter('benchmark.x2', low=0, high=42)
+        self.top.driver.add_parameter('benchmark.x3', low=0, high=42)
+
+        self._set_dvs(self.top.driver,
+                      [('benchmark.x1', 'i', slice(0, 1)),
+                       ('benchmark.x2', 'i', slice(1, 2)),
+                       ('benchmark.x3', 'i', slice(2, 3))],
+                      {'benchmark.x1': np.array([23.6]),
+                       'benchmark.x2': np.array([12.2]),
+                       'benchmark.x3': np.array([11.7])})
+
+        self.assertEqual(self.top.benchmark.x1, 24)
+        self.assertEqual(self.top.benchmark.x2, 12)
+        self.assertEqual(self.top.benchmark.x3, 12)
+        self.assertTrue(isinstance(self.top.benchmark.x1, int))
+
+    def test_set_int_array_param(self):
+
+        self.top = set_as_top(Assembly())
+        self.top.add('comp', IntArrayComp())
+        self.top.add('driver', pyOptSparseDriver())
+        self.top.driver.workflow.add('comp')
+        self.top.driver.add_parameter('comp.ix', low=0, high=10)
+
+        self._set_dvs(self.top.driver,
+                      [('comp.ix', 'i', slice(0, 2))],
+                      {'comp.ix': np.array([1.2, 2.8])})
+
+        self.assertEqual(list(self.top.comp.ix), [1, 3])
+        self.assertEqual(self.top.comp.ix.dtype.kind, 'i')
+
+    def test_set_float_array_with_int_param(self):
+
+        self.top = set_as_top(Assembly())
+        self.top.add('comp', IntArrayComp())
+        self.top.add('driver', pyOptSparseDriver())
+        self.top.driver.workflow.add('comp')
+        self.top.driver.add_parameter('comp.n', low=0, high=10)
+        self.top.driver.add_parameter('comp.x', low=-10., high=10.)
+
+        # With an integer present, the float array reaches set_parameters
+        # as a python list.
+        self._set_dvs(self.top.driver,
+                      [('comp.n', 'i', slice(0, 1)),
+                       ('comp.x', 'c', slice(1, 3))],
+                      {'comp.n': np.array([4.4]),
+                       'comp.x': np.array([0.25, -1.5])})
+
+        self.assertEqual(self.top.comp.n, 4)
+        self.assertTrue(isinstance(self.top.comp.x, np.ndarray))
+        self.assertEqual(list(self.top.comp.x), [0.25, -1.5])
+
+    def test_callbacks_before_execute(self):
+
+        driver = pyOptSparseDriver()
+        self.assertRaises(RuntimeError, driver.objfunc, {})
+        self.assertRaises(RuntimeError, driver.gradfunc, {}, {})
+
+    def _con_wrts(self):
+        # The wrt list execute() would give each nonlinear constraint.
+        driver = self.top.driver
+        param_list = ['p1.x', 'p2.x']
+        param_reach = driver._param_descendants(param_list)
+        return [driver._con_wrt(con, param_list, param_reach)
+                for con in driver.get_constraints().values()]
+
+    def test_con_wrt(self):
+
+        self.top = set_as_top(TwoParaboloids())
+
+        self.assertEqual(self._con_wrts(), [['p1.x'], ['p1.x', 'p2.x'],
+                                            ['p1.x', 'p2.x']])
+
+    def test_con_wrt_missing_target(self):
+
+        self.top = set_as_top(TwoParaboloids())
+        self.top._depgraph.remove_node('p1.x')
+
+        # Without dependency information every constraint stays dense.
+        self.assertEqual(self.top.driver._param_descendants(['p1.x', 'p2.x']),
+                         None)
+        self.assertEqual(self._con_wrts(), [['p1.x', 'p2.x'],
+                                            ['p1.x', 'p2.x'],
+                                            ['p1.x', 'p2.x']])
+
+    def test_skip_redundant_final_run(self):
+
+        self.top = self._counted_optimization()
+        self.top.run()
+        driver = self.top.driver
+
+        dv_dict = {'paraboloid.x': np.array([1.0]),
+                   'paraboloid.y': np.array([2.0])}
+        funcs, fail = driver.objfunc(dv_dict)
+        self.assertEqual(fail, 0)
+
+        # The model was last run at this point, so there is no re-run.
+        n_runs = driver.n_runs
+        driver._restore_optimum(dv_dict)
+        self.assertEqual(driver.n_runs, n_runs)
+        self.assertEqual(self.top.paraboloid.x, 1.0)
+        self.assertEqual(self.top.paraboloid.y, 2.0)
+
+        # A different point is always run.
+        driver._restore_optimum({'paraboloid.x': np.array([3.0]),
+                                 'paraboloid.y': np.array([2.0])})
+        self.assertEqual(driver.n_runs, n_runs + 1)
+        self.assertEqual(self.top.paraboloid.x, 3.0)
+
+        # As is the same point once the skip is turned off.
+        driver.skip_redundant_final_run = False
+        n_runs = driver.n_runs
+        driver._restore_optimum({'paraboloid.x': np.array([3.0]),
+                                 'paraboloid.y': np.array([2.0])})
+        self.assertEqual(driver.n_runs, n_runs + 1)
+
+        # calc_gradient leaves the model state unknown, so the run happens
+        # even with the skip on.
+        driver.skip_redundant_final_run = True
+        dv_dict = {'paraboloid.x': np.array([5.0]),
+                   'paraboloid.y': np.array([2.0])}
+        funcs, fail = driver.objfunc(dv_dict)
+        sens, fail = driver.gradfunc(dv_dict, funcs)
+        self.assertEqual(fail, 0)
+        n_runs = driver.n_runs
+        driver._restore_optimum(dv_dict)
+        self.assertEqual(driver.n_runs, n_runs + 1)
+
+    def test_gradfunc_clears_model_state(self):
+
+        self.top = self._counted_optimization()
+        self.top.run()
+        driver = self.top.driver
+
+        dv_dict = {'paraboloid.x': np.array([1.0]),
+                   'paraboloid.y': np.array([2.0])}
+        funcs, fail = driver.objfunc(dv_dict)
+        self.assertEqual(fail, 0)
+        self.assertEqual(list(driver._model_dvs), [1.0, 2.0])
+
+        # calc_gradient may leave the model at a perturbed point.
+        sens, fail = driver.gradfunc(dv_dict, funcs)
+        self.assertEqual(fail, 0)
+        self.assertEqual(driver._model_dvs, None)
+
+    def test_memo_repeated_point(self):
+
+        self.top = self._counted_optimization()
+        self.top.run()
+        driver = self.top.driver
+
+        dv_dict = {'paraboloid.x': np.array([1.0]),
+                   'paraboloid.y': np.array([2.0])}
+
+        # The result buffers are reused, so keep a copy of the values.
+        funcs, fail = driver.objfunc(dv_dict)
+        funcs = dict((name, val.copy()) for name, val in funcs.items())
+        n_runs = driver.n_runs
+
+        funcs2, fail = driver.objfunc(dv_dict)
+        self.assertEqual(fail, 0)
+        self.assertEqual(driver.n_runs, n_runs)
+        for name, val in funcs.items():
+            self.assertEqual(list(funcs2[name]), list(val))
+
+        # Count the calc_gradient calls made by a fresh gradfunc closure.
+        calls = []
+        calc_gradient = driver.workflow.calc_gradient
+
+        def counting_calc_gradient(*args, **kwargs):
+            calls.append(args)
+            return calc_gradient(*args, **kwargs)
+
+        driver.workflow.calc_gradient = counting_calc_gradient
+        driver._gradfunc = driver._make_gradfunc()
+
+        sens, fail = driver.gradfunc(dv_dict, funcs)
+        sens2, fail = driver.gradfunc(dv_dict, funcs)
+        self.assertEqual(fail, 0)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(sens2 is sens)
+        for name, jacs in sens.items():
+            for wrt, jac in jacs.items():
+                self.assertTrue(np.all(sens2[name][wrt] == jac))
+
+    def test_basic_SLSQP_fd_workers(self):
+
+        try:
+            from pyoptsparse import Optimization
+        except ImportError:
+            raise SkipTest("this test requires pyoptsparse to be installed")
+
+        self.top = OptimizationConstrained()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.title = 'Little Test with Worker Gradient'
+        optdict = {}
+        self.top.driver.options = optdict
+        self.top.driver.n_workers = 2
+
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+        # The pool is closed by now, so later calls fall back to
+        # calc_gradient.
+        driver = self.top.driver
+        self.assertEqual(driver._pool, None)
+        dv_dict = {'paraboloid.x': np.array([1.0]),
+                   'paraboloid.y': np.array([2.0])}
+        funcs, fail = driver.objfunc(dv_dict)
+        self.assertEqual(fail, 0)
+        sens, fail = driver.gradfunc(dv_dict, funcs)
+        self.assertEqual(fail, 0)
+
+    def test_fd_workers_with_recorders(self):
+
+        self.top = OptimizationConstrained()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.n_workers = 2
+        self.top.recorders = [ListCaseRecorder()]
+
+        self.assertRaises(RuntimeError, self.top.run)
+        self.assertEqual(self.top.driver._pool, None)
+
     #def test_GA_multi_obj_multi_con(self):
         ## Note, just verifying that things work functionally, rather than run
         ## this for many generations.